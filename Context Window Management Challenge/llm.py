@@ -1,88 +1,561 @@
-from openai import OpenAI
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict, deque
+from itertools import islice
+
+import httpx
+import numpy as np
+import tiktoken
+from openai import AsyncOpenAI
+
+# BPE tokenizer matching the model, used to count the tokens of each message once when it is added.
+# Text is always encoded with encode_ordinary: chat content is never meant to contain special tokens, and skipping the
+# special-token scan both saves a regex pass over every message and keeps text such as '<|endoftext|>' from raising.
+try:
+    _ENC = tiktoken.encoding_for_model("gpt-4-1106-preview")
+except KeyError:
+    _ENC = tiktoken.get_encoding("cl100k_base")
+
+# Roles accepted by send_message
+_VALID_ROLES = frozenset({'user', 'assistant', 'system'})
+
+# Fixed system prompt for structured summarization, together with its pre-computed token count
+_SUMMARIZE_SYSTEM_PROMPT = (
+    "Summarize each of the following conversation chunks independently, preserving the most crucial information for maintaining dialogue context. "
+    'Respond with a JSON object of the form {"summaries": [{"summary": "...", "open_goals": ["..."], "known_facts": ["..."]}]} '
+    "containing exactly one entry per chunk, in order. All three keys are required in every entry: "
+    '"summary" is a concise string, "open_goals" lists the user\'s unresolved goals and "known_facts" lists facts established so far; '
+    "the lists may be empty."
+)
+_SUMMARIZE_SYSTEM_TOKENS = len(_ENC.encode_ordinary(_SUMMARIZE_SYSTEM_PROMPT))
+
+# Tool through which the model can look up earlier messages that were summarized out of the context window
+_RECALL_TOOL = {
+    'type': 'function',
+    'function': {
+        'name': 'recall',
+        'description': 'Look up earlier messages of this conversation that were summarized away. Use it when a detail you need is missing from the summaries.',
+        'parameters': {
+            'type': 'object',
+            'properties': {'query': {'type': 'string', 'description': 'What to look for in the earlier conversation.'}},
+            'required': ['query']
+        }
+    }
+}
+_RECALL_TOOL_TOKENS = len(_ENC.encode_ordinary(json.dumps(_RECALL_TOOL)))
 
 class llm:
-    def __init__(self):
-        # The full_message_history will store the entire conversation history as is
-        # The summarized_message_history  will store a summarized version of the conversation history
-        self.full_message_history = []
-        self.summarized_message_history = []
-        self.client = OpenAI(api_key='')  # OpenAI client with API key
+    # Role prefixes used when flattening messages into a summarization prompt
+    _ROLE_PREFIX = {'user': 'user: ', 'assistant': 'assistant: ', 'system': 'system: '}
+
+    # Fixed attribute layout: no per-instance __dict__, which keeps one instance per session small
+    __slots__ = (
+        'client', 'DEBUG',
+        'token_threshold_to_trigger_summarization', 'sliding_window_size', 'turns_per_summary',
+        'summary_token_budget', 'speculative_summarization_ratio', 'summarization_target_ratio', 'hard_token_limit',
+        'response_cache_size', 'max_response_tokens',
+        '_enc', '_audit_log', '_anchor', '_user_anchored', '_summaries', '_sliding', '_pending_summary',
+        '_full_tokens', '_summ_tokens', '_anchor_tokens', '_summaries_tokens', '_response_cache', '_context_cache',
+        'embedding_model', 'recall_token_budget', 'recall_corpus_size', '_recall_blocks', '_recall_size', '_recall_matrix',
+    )
+
+    def __init__(self, system_prompt: str = None):
+        # The audit log records the role, token count and time of every message, without keeping a second copy of its content
+        # The summarized version of the conversation is kept as an append-only prefix so that it stays cache friendly:
+        #   anchors + summaries S_1..S_L + sliding window of the most recent raw turns
+        # Summaries are appended, and only rewritten when they outgrow their budget and are merged into one rolling summary.
+        # The anchors (the optional static system message and the first user message) are never summarized,
+        # so the original task stays in the context window verbatim.
+        self._audit_log = []  # (role, token_count, timestamp) tuples, one per message
+        self._anchor = [{'role': 'system', 'content': system_prompt}] if system_prompt else []  # Messages pinned at the start of the context window
+        self._user_anchored = False  # Whether the first user message has been seen, pinned or not
+        self._summaries = deque()  # Summaries of the turns that have left the sliding window, oldest first
+        self._sliding = deque()  # Most recent raw turns, kept verbatim; summarized turns are popped from the left in O(1)
+        self._context_cache = None  # Assembled context window, kept up to date on append and rebuilt after other changes
+        # Asynchronous OpenAI client with API key. A single HTTP/2 connection pool with keep-alive is shared by every call,
+        # so summarization and conversation requests reuse one TLS connection instead of opening new ones.
+        self.client = AsyncOpenAI(
+            api_key='',
+            http_client=httpx.AsyncClient(
+                http2=True,
+                timeout=httpx.Timeout(60.0, connect=5.0),
+                limits=httpx.Limits(max_connections=16, max_keepalive_connections=8)
+            )
+        )
         self.DEBUG = False  # Debug flag
         if self.client.api_key == '':
             raise ValueError("\033[91m Please enter the OpenAI API key which was provided in the challenge email into llm.py.\033[0m")
         
         self.token_threshold_to_trigger_summarization = 1024  # Token threshold to trigger summarization
+        self.sliding_window_size = 6  # Number of most recent raw turns kept verbatim after summarization
+        self.turns_per_summary = 10  # Number of raw turns compressed into each summary
+        self.summary_token_budget = 512  # Token count of the summaries above which they are merged into one rolling summary
+        self.speculative_summarization_ratio = 0.9  # Fraction of the threshold at which summarization starts in the background
+        self.summarization_target_ratio = 0.5  # Fraction of the threshold the history is summarized down to, leaving room for new turns
+        self.hard_token_limit = 2048  # Token count above which summarization runs again right after a background summary is spliced in
+        self._pending_summary = None  # Background summarization task started at the end of the previous turn
+
+        self._enc = _ENC  # BPE tokenizer, shared by all instances
+        # Running token counts, updated incrementally so the threshold check never re-walks the history
+        self._full_tokens = 0  # Token count of the full message history
+        self._summ_tokens = self.calculate_total_tokens(self._anchor)  # Token count of the summarized message history
+        self._anchor_tokens = self._summ_tokens  # Token count of the anchors alone, which summarization cannot reduce
+        self._summaries_tokens = 0  # Token count of the summaries alone
+
+        # LRU cache of one-shot responses, keyed by a fixed-size hash of the prompts so identical summarization requests are not re-sent
+        self._response_cache = OrderedDict()
+        self.response_cache_size = 256  # Maximum number of cached one-shot responses
+        self.max_response_tokens = 4096  # Upper bound on the completion tokens requested per call
+
+        # Semantic recall index over the turns that were summarized out of the sliding window. Each summarization adds one
+        # block of messages and their embeddings; the blocks are only stacked into one matrix when recall needs it, so
+        # indexing never copies the earlier embeddings. The embeddings are unit length, so inner products are cosine similarities.
+        self.embedding_model = 'text-embedding-3-small'  # Model used to embed messages and recall queries
+        self.recall_token_budget = 512  # Maximum tokens of earlier messages returned by one recall
+        self.recall_corpus_size = 2048  # Maximum messages kept in the recall index; the oldest blocks beyond it are dropped
+        self._recall_blocks = deque()  # (messages, embeddings) pairs, oldest first
+        self._recall_size = 0  # Number of messages in the recall blocks
+        self._recall_matrix = None  # (corpus, stacked embeddings) of all blocks, built by recall and dropped when blocks change
     
     def add_message_to_history(self, message):
         """
-        Adds a message to both the full message history and the summarized message history.
+        Adds a message to the summarized message history and records it in the audit log.
+        The first user message is pinned as an anchor when it opens the conversation; every other message enters the sliding window.
+        A first user message that follows earlier turns is left in the sliding window, so the chronological order is kept.
+        The message is encoded once here; its token count is cached on the message under the '_tokens' key.
 
         Args:
             message (dict): A dictionary with 'role' and 'content' keys.
         """
-        self.full_message_history.append(message)
-        self.summarized_message_history.append(message)
+        tokens = self._count_tokens(message)
+        self._full_tokens += tokens
+        self._summ_tokens += tokens
+        self._audit_log.append((message['role'], tokens, time.time()))
+        pin = message['role'] == 'user' and not self._user_anchored and not self._sliding and not self._summaries
+        if message['role'] == 'user':
+            self._user_anchored = True
+        if pin:
+            self._anchor.append(message)
+            self._anchor_tokens += tokens
+            self._context_cache = None
+        else:
+            self._sliding.append(message)
+            if self._context_cache is not None:
+                self._context_cache.append(message)
+
+    def _count_tokens(self, message):
+        """
+        Returns the number of tokens in a message, encoding its content only if it has not been counted before.
+
+        Args:
+            message (dict): A dictionary with 'role' and 'content' keys.
+
+        Returns:
+            int: The number of tokens in the message content.
+        """
+        if '_tokens' not in message:
+            message['_tokens'] = len(self._enc.encode_ordinary(message['content']))
+        return message['_tokens']
 
-    def calculate_total_tokens(self, messages):
+    def calculate_total_tokens(self, messages=None):
         """
         Calculates the total number of tokens in the message history.
 
         Args:
-            messages (list): A list of messages. Each message is a dictionary with 'role' and 'content' keys.
+            messages (list, optional): A list of messages. Each message is a dictionary with 'role' and 'content' keys.
+                                       Defaults to None, in which case the running count of the summarized message history is returned.
 
         Returns:
             int: The total number of tokens in the message history.
         """
-        return sum(len(message['content'].split()) for message in messages)
+        if messages is None:
+            return self._summ_tokens
+        return sum(map(self._count_tokens, messages))
 
-    def summarize_chat_history(self):
+    def _summarizable_tokens(self):
         """
-        Summarizes the chat history to avoid token limits.
+        Returns the token count of the summaries and the sliding window, which is what the summarization thresholds apply to.
+        The anchors are left out: they are never summarized, so counting them would make an oversized first message
+        trigger summarization on every turn without ever bringing the history under the threshold.
 
         Returns:
-            list: A list of dictionaries. Each dictionary represents a summarized conversation with 'role' and 'content' keys.
+            int: The number of tokens in the summaries and the sliding window.
+        """
+        return self._summ_tokens - self._anchor_tokens
+
+    def _format_turns(self, messages):
+        """
+        Flattens messages into a single 'role: content' string for a summarization prompt.
+
+        Args:
+            messages (list): A list of messages. Each message is a dictionary with 'role' and 'content' keys.
+
+        Returns:
+            str: The flattened conversation.
+        """
+        role_prefix = self._ROLE_PREFIX
+        return ' '.join(role_prefix[message['role']] + message['content'] for message in messages)
+
+    @staticmethod
+    def _parse_summaries(response, count):
+        """
+        Parses and validates a structured summarization response.
+
+        Args:
+            response (str): The JSON response of the summarizer.
+            count (int): The number of chunks that were summarized.
+
+        Returns:
+            list: One dictionary with 'summary', 'open_goals' and 'known_facts' keys per chunk, or None if the response
+                  does not match the schema.
         """
-        system_prompt = "Summarize this conversation, preserving the most crucial information for maintaining dialogue context:"
-        user_prompt = ' '.join([f"{message['role']}: {message['content']}" for message in self.summarized_message_history[:-1]])
+        try:
+            summaries = json.loads(response)['summaries']
+        except (json.JSONDecodeError, KeyError, TypeError):
+            return None
+        if not isinstance(summaries, list) or len(summaries) != count:
+            return None
+        for summary in summaries:
+            if not isinstance(summary, dict) or not isinstance(summary.get('summary'), str):
+                return None
+            for key in ('open_goals', 'known_facts'):
+                items = summary.get(key)
+                if not isinstance(items, list) or not all(isinstance(item, str) for item in items):
+                    return None
+        return summaries
+
+    @staticmethod
+    def _summary_message(summary):
+        """
+        Renders a structured summary as the system message that stands in for the summarized turns.
+
+        Args:
+            summary (dict): A dictionary with 'summary', 'open_goals' and 'known_facts' keys.
+
+        Returns:
+            dict: A system message; the structured summary is kept on it under the '_structured' key.
+        """
+        lines = [f"Prior conversation summary: {summary['summary']}"]
+        if summary['open_goals']:
+            lines.append(f"Open goals: {'; '.join(summary['open_goals'])}")
+        if summary['known_facts']:
+            lines.append(f"Known facts: {'; '.join(summary['known_facts'])}")
+        return {'role': 'system', 'content': '\n'.join(lines), '_structured': summary}
+
+    async def _summarize_chunks(self, chunks):
+        """
+        Summarizes several independent chunks of the chat history with a single structured request.
+
+        The chunks are delimited with <CHUNK i> tags and summarized together in JSON mode, which saves the fixed
+        per-request overhead of one call per chunk. A response that does not match the schema is retried once;
+        if it still does not, several chunks are summarized individually and a single chunk falls back to the
+        raw response text.
+
+        Args:
+            chunks (list): A list of chunks. Each chunk is a list of messages with 'role' and 'content' keys.
+
+        Returns:
+            list: One dictionary with 'summary', 'open_goals' and 'known_facts' keys per chunk, in the same order.
+        """
+        user_prompt = ' '.join(f"<CHUNK {i}>{self._format_turns(chunk)}</CHUNK {i}>" for i, chunk in enumerate(chunks, 1))
 
         if self.DEBUG:
             print(f"\033[91m  Summarizing chat history... \033[0m")
-            print(f"\033[91m  System prompt: {system_prompt} \033[0m")
+            print(f"\033[91m  System prompt: {_SUMMARIZE_SYSTEM_PROMPT} \033[0m")
             print(f"\033[91m  User prompt: {user_prompt} \033[0m")
 
-        response = self.gpt4_one_shot(
-            system_prompt=system_prompt,
-            user_prompt=user_prompt
-        )
-        return [{'role': 'system', 'content': response}]
+        for attempt in range(2):
+            response = await self.gpt4_one_shot(
+                system_prompt=_SUMMARIZE_SYSTEM_PROMPT,
+                user_prompt=user_prompt,
+                json_response=True,
+                system_tokens=_SUMMARIZE_SYSTEM_TOKENS,
+                use_cache=attempt == 0  # The retry must not be answered with the cached malformed response
+            )
+            summaries = self._parse_summaries(response, len(chunks))
+            if summaries is not None:
+                return summaries
+            if self.DEBUG:
+                print(f"\033[91m  Summary response does not match the schema \033[0m")
+
+        if len(chunks) > 1:
+            individual = await asyncio.gather(*(self._summarize_chunks([chunk]) for chunk in chunks))
+            return [summaries[0] for summaries in individual]
+        return [{'summary': response, 'open_goals': [], 'known_facts': []}]
 
-    def manage_context_window(self):
+    async def summarize_chat_history(self, messages):
         """
-        This function creates the context window to be sent to the LLM. The context window is managed list of messages, and constitutes all the information the LLM knows about the conversation.
+        Summarizes a slice of the chat history to avoid token limits.
+
+        Args:
+            messages (list): The messages to summarize. Each message is a dictionary with 'role' and 'content' keys.
 
         Returns:
-            list: The context window to be sent to the LLM.
+            list: A list of dictionaries. Each dictionary represents a summarized conversation with 'role' and 'content' keys.
+        """
+        summaries = await self._summarize_chunks([messages])
+        return [self._summary_message(summaries[0])]
+
+    def _turns_to_summarize(self, target_tokens):
+        """
+        Returns how many of the oldest raw turns to move out of the sliding window when summarization runs.
+        At most sliding_window_size turns are kept verbatim, and further turns are taken from the head of the window
+        until the summaries and the sliding window fit in target_tokens; the latest message is always kept.
+
+        Args:
+            target_tokens (int): The token count the summaries and the sliding window should be brought down to.
+
+        Returns:
+            int: The number of turns to summarize, possibly zero.
+        """
+        count = max(0, len(self._sliding) - self.sliding_window_size)
+        tokens = self._summarizable_tokens() - self.calculate_total_tokens(islice(self._sliding, count))
+        for message in islice(self._sliding, count, len(self._sliding) - 1):
+            if tokens <= target_tokens:
+                break
+            tokens -= self._count_tokens(message)
+            count += 1
+        return count
+
+    async def _summarize_oldest(self, oldest):
+        """
+        Splits the oldest turns into windows of turns_per_summary turns and summarizes every window in one batched request.
+        Once the summaries have outgrown summary_token_budget, they are merged into one rolling summary as an extra chunk
+        of the same request. The turns are also embedded for the recall index, so they can still be looked up once they
+        leave the context window.
+
+        Args:
+            oldest (list): The turns at the head of the sliding window to summarize.
+
+        Returns:
+            tuple: The (merged summaries, rolling summary message) pair, or None if nothing was merged, the
+                   (window, summary message) pairs, oldest window first, and the recall block of the turns, or None.
+        """
+        windows = [oldest[i:i + self.turns_per_summary] for i in range(0, len(oldest), self.turns_per_summary)]
+        merged = list(self._summaries) if self._summaries_tokens > self.summary_token_budget and len(self._summaries) > 1 else []
+        chunks = [merged, *windows] if merged else windows
+        # The turns are embedded while they are being summarized, so indexing adds no latency of its own.
+        # The embeddings are dropped if summarization fails, since the same turns will be summarized and embedded again.
+        embedding = asyncio.create_task(self._embed_for_recall(oldest))
+        try:
+            summaries = await self._summarize_chunks(chunks)
+        except BaseException:
+            embedding.cancel()
+            raise
+        recall_block = await embedding
+        rolling = (merged, self._summary_message(summaries.pop(0))) if merged else None
+        return rolling, [(window, self._summary_message(summary)) for window, summary in zip(windows, summaries)], recall_block
+
+    async def _embed_for_recall(self, messages):
+        """
+        Embeds messages with a single request, producing a block for the recall index.
+        Recall is best-effort: empty messages are skipped, since the embeddings endpoint rejects empty input, and a failed
+        request only leaves these messages out of the index instead of failing the summarization it runs alongside.
+
+        Args:
+            messages (list): The messages to embed. Each message is a dictionary with 'role' and 'content' keys.
+
+        Returns:
+            tuple: The (messages, embeddings) block, or None if there was nothing to embed or the request failed.
+        """
+        messages = [message for message in messages if message['content'].strip()]
+        if not messages:
+            return None
+        try:
+            response = await self.client.embeddings.create(input=[message['content'] for message in messages], model=self.embedding_model)
+        except Exception as e:
+            if self.DEBUG:
+                print(f"\033[91m  Indexing for recall failed: {e} \033[0m")
+            return None
+        return messages, np.asarray([item.embedding for item in response.data], dtype=np.float32)
+
+    def _add_to_recall(self, block):
+        """
+        Adds a block of embedded messages to the recall index, dropping the oldest blocks beyond recall_corpus_size messages.
+
+        Args:
+            block (tuple): A (messages, embeddings) pair.
+        """
+        messages, _ = block
+        self._recall_blocks.append(block)
+        self._recall_size += len(messages)
+        while self._recall_size > self.recall_corpus_size and len(self._recall_blocks) > 1:
+            self._recall_size -= len(self._recall_blocks.popleft()[0])
+        self._recall_matrix = None
+
+    async def recall(self, query: str, k: int = 4):
+        """
+        Looks up the earlier messages most similar to a query among the turns that were summarized away.
+
+        Args:
+            query (str): What to look for in the earlier conversation.
+            k (int, optional): The maximum number of messages to return. Defaults to 4.
+
+        Returns:
+            list: Up to k messages, most similar first, limited to recall_token_budget tokens in total.
+        """
+        if not self._recall_blocks or not query.strip():
+            return []
+        if self._recall_matrix is None:
+            corpus = [message for messages, _ in self._recall_blocks for message in messages]
+            self._recall_matrix = corpus, np.vstack([vectors for _, vectors in self._recall_blocks])
+        corpus, matrix = self._recall_matrix
+
+        response = await self.client.embeddings.create(input=[query], model=self.embedding_model)
+        scores = matrix @ np.asarray(response.data[0].embedding, dtype=np.float32)
+        k = min(k, len(corpus))
+        top = np.argpartition(-scores, k - 1)[:k]
+
+        recalled = []
+        budget = self.recall_token_budget
+        for index in top[np.argsort(-scores[top])]:
+            message = corpus[index]
+            tokens = self._count_tokens(message)
+            if tokens <= budget:
+                recalled.append(message)
+                budget -= tokens
+        return recalled
+
+    async def _run_tool_call(self, name: str, arguments: str):
         """
-        # The chat history is summarized only when the token threshold is exceeded.
-        # This approach helps to avoid unnecessary computation for summarization and
-        # ensures that the most recent messages remain fully intact in the context window.
-        # The threshold can be adjusted as required.
-        if self.calculate_total_tokens(self.summarized_message_history) >= self.token_threshold_to_trigger_summarization:
+        Runs a tool call requested by the model.
+
+        Args:
+            name (str): The name of the tool.
+            arguments (str): The JSON encoded arguments of the call.
+
+        Returns:
+            str: The result of the call, sent back to the model as the content of a tool message.
+        """
+        try:
+            query = json.loads(arguments)['query']
+        except (json.JSONDecodeError, KeyError, TypeError):
+            query = None
+        if name != 'recall' or not isinstance(query, str):
+            return json.dumps({'error': f"Unsupported tool call: {name}({arguments})"})
+        try:
+            recalled = await self.recall(query)
+        except Exception as e:
             if self.DEBUG:
-                print(f"\033[91m  Token threshold exceeded, triggering summarization \033[0m")
-            summarized_history = self.summarize_chat_history()
-            # Ensure the latest user message is always included
-            summarized_history.append(self.summarized_message_history[-1])
-            self.summarized_message_history = summarized_history
+                print(f"\033[91m  Recall failed: {e} \033[0m")
+            return json.dumps({'error': 'Recall is unavailable right now.'})
+        if self.DEBUG:
+            print(f"\033[91m  Recalled for '{query}': {recalled} \033[0m")
+        return json.dumps([self._ROLE_PREFIX[message['role']] + message['content'] for message in recalled])
+
+    def _append_summaries(self, rolling, summarized, recall_block):
+        """
+        Replaces the oldest turns of the sliding window with their summaries, which are appended after the previous summaries.
+        If the previous summaries were merged into a rolling summary, it replaces them first, so no summarized context is lost.
+        The summarized turns are added to the recall index only here, once their summaries are in place.
+
+        Args:
+            rolling (tuple): The (merged summaries, rolling summary message) pair, or None if nothing was merged.
+            summarized (list): (window, summary message) pairs covering the turns at the head of the sliding window, oldest first.
+            recall_block (tuple): The (messages, embeddings) block of the summarized turns, or None if they were not embedded.
+        """
+        self._context_cache = None
+        if rolling is not None:
+            # The summaries only change here, so the merged summaries are still at the head of the summaries
+            merged, summary = rolling
+            for _ in merged:
+                self._summaries.popleft()
+            self._summaries.appendleft(summary)
+            merged_tokens = self._count_tokens(summary) - self.calculate_total_tokens(merged)
+            self._summaries_tokens += merged_tokens
+            self._summ_tokens += merged_tokens
+        for window, summary in summarized:
+            for _ in window:
+                self._sliding.popleft()
+            self._summaries.append(summary)
+            summary_tokens = self._count_tokens(summary)
+            self._summaries_tokens += summary_tokens
+            self._summ_tokens += summary_tokens - self.calculate_total_tokens(window)
+        if recall_block is not None:
+            self._add_to_recall(recall_block)
+        if self.DEBUG:
+            print(f"\033[91m  Summaries: {self._summaries} \033[0m")
+
+    def _schedule_speculative_summary(self):
+        """
+        Starts summarizing the oldest turns in the background once the history approaches the token threshold,
+        so the summary is usually ready before the next message arrives instead of delaying that turn.
+        The history is summarized down to summarization_target_ratio of the threshold, so it takes several turns to fill up again.
+        """
+        if self._pending_summary is not None:
+            return
+        if self._summarizable_tokens() <= self.speculative_summarization_ratio * self.token_threshold_to_trigger_summarization:
+            return
+        count = self._turns_to_summarize(self.summarization_target_ratio * self.token_threshold_to_trigger_summarization)
+        if count > 0:
             if self.DEBUG:
-                print(f"\033[91m  Summarized message history: {self.summarized_message_history} \033[0m")
+                print(f"\033[91m  Summarizing the {count} oldest turns of the sliding window in the background \033[0m")
+            self._pending_summary = asyncio.create_task(self._summarize_oldest(list(islice(self._sliding, count))))
+
+    def _summarization_due(self, spliced=False):
+        """
+        Returns whether the oldest raw turns must be summarized before the context window is sent,
+        because the sliding window is full or the token threshold is exceeded.
+        Right after a background summary was spliced in, only exceeding hard_token_limit makes summarization due,
+        so a turn is never summarized twice just because the messages added since the snapshot tip it over the threshold.
+
+        Args:
+            spliced (bool, optional): Whether a background summary was just spliced in. Defaults to False.
 
-        return self.summarized_message_history
+        Returns:
+            bool: True if summarization is due.
+        """
+        if spliced:
+            return self._summarizable_tokens() >= self.hard_token_limit
+        window_is_full = len(self._sliding) >= self.sliding_window_size + self.turns_per_summary
+        return window_is_full or self._summarizable_tokens() >= self.token_threshold_to_trigger_summarization
 
-    def send_message(self, prompt: str, role: str = 'user', json_response: bool = False):
+    async def manage_context_window(self):
+        """
+        This function creates the context window to be sent to the LLM. The context window is managed list of messages, and constitutes all the information the LLM knows about the conversation.
+
+        Returns:
+            list: The context window to be sent to the LLM.
+        """
+        # Splice in the summaries started in the background at the end of the previous turn.
+        # Turns are only ever appended to the sliding window, so the summarized snapshot is still at its head.
+        spliced = self._pending_summary is not None
+        if spliced:
+            pending, self._pending_summary = self._pending_summary, None
+            self._append_summaries(*await pending)
+
+        # The oldest raw turns are summarized only once the sliding window is full or the token threshold is exceeded.
+        # Each summary covers only the turns that left the window and is appended after the previous summaries,
+        # so the prefix of the context window stays identical between turns and can be served from the provider's prompt cache.
+        # The most recent turns always remain fully intact in the context window.
+        # Every window that has accumulated is collected and summarized in a single request.
+        if self._summarization_due(spliced):
+            count = self._turns_to_summarize(self.summarization_target_ratio * self.token_threshold_to_trigger_summarization)
+            if count > 0:
+                if self.DEBUG:
+                    print(f"\033[91m  Summarizing the {count} oldest turns of the sliding window \033[0m")
+                self._append_summaries(*await self._summarize_oldest(list(islice(self._sliding, count))))
+
+        return self._assemble_context()
+
+    def _assemble_context(self):
+        """
+        Returns the context window without checking whether summarization is due.
+        The assembled list is cached and only rebuilt after the anchors or summaries change.
+
+        Returns:
+            list: The context window to be sent to the LLM. It must not be modified by the caller.
+        """
+        if self._context_cache is None:
+            self._context_cache = [*self._anchor, *self._summaries, *self._sliding]
+        return self._context_cache
+
+    async def send_message(self, prompt: str, role: str = 'user', json_response: bool = False):
         """
         This function adds the provided prompt to the existing message history, creating a context window for the LLM. 
-        This context window is forwarded to the LLM. The received response from the LLM is then appended to the message history and returned.
+        This context window is forwarded to the LLM. The response is streamed back as it is generated, and once it is complete it is appended to the message history.
 
         Args:
             prompt (str): The message content to be sent to the LLM.
@@ -92,49 +565,65 @@ class llm:
                 - 'system': Represents instructions or context for the AI.
             json_response (bool, optional): Specifies whether the response should be returned as JSON. Defaults to False. If True, schema must be specified.
 
-        Returns:
-            str: The AI's response to the message.
+        Yields:
+            str: Consecutive pieces of the AI's response to the message.
 
         Raises:
-            ValueError: If an invalid role is provided.
+            ValueError: If an invalid role is provided, or if the context window exceeds the 4096 token limit.
 
         Note:
-            - The `context_window` is currently using a primitive way of managing conversation history, simply keeping only the last 4 messages.
+            - The `context_window` is built by `manage_context_window`: the pinned anchors, the accumulated summaries and the most recent raw turns.
 
         Example:
             >>> helper = OpenAIHelper()
-            >>> response = helper.send_message("Hello, how can I assist you?")
-            >>> print(response)
-            "Sure, I can help you with that!"
-        """
-        if role == 'user':
-            self.add_message_to_history({'role': 'user', 'content': prompt})
-        elif role == 'assistant':
-            self.add_message_to_history({'role': 'assistant', 'content': prompt})
-        elif role == 'system':
-            self.add_message_to_history({'role': 'system', 'content': prompt})
-        else:
+            >>> async for delta in helper.send_message("Hello, how can I assist you?"):
+            ...     print(delta, end='')
+            Sure, I can help you with that!
+        """
+        if role not in _VALID_ROLES:
             raise ValueError("Invalid role provided. Valid roles are 'user', 'assistant', or 'system'.")
+        self.add_message_to_history({'role': role, 'content': prompt})
 
-        context_window = self.manage_context_window()
+        # In the steady state nothing is pending or due for summarization, so the cached context window is reused as is
+        if self._pending_summary is None and not self._summarization_due():
+            context_window = self._assemble_context()
+        else:
+            context_window = await self.manage_context_window()
 
         if self.DEBUG:
             print(f"\033[91m  Context sent to LLM:\n  {context_window} \033[0m")
 
-        # Send the message to the LLM and get the response.
-        response = self.gpt4_conversation(context_window)
-
-        ai_message = response.choices[0].message.content
+        # Send the message to the LLM and stream the response as it arrives.
+        buffer = []
+        async for delta in self.gpt4_conversation(context_window):
+            buffer.append(delta)
+            yield delta
+        ai_message = ''.join(buffer)
 
         self.add_message_to_history({'role': 'assistant', 'content': ai_message})
-        return ai_message
+        self._schedule_speculative_summary()
+
+    def _response_token_budget(self, prompt_tokens: int, message_count: int):
+        """
+        Computes max_tokens for a completion from what the prompt leaves of the 4096 token limit,
+        so requests do not reserve far more completion tokens than can actually be used.
+
+        Args:
+            prompt_tokens (int): The number of tokens in the content of the prompt messages.
+            message_count (int): The number of prompt messages; each adds about 4 tokens of chat formatting.
+
+        Returns:
+            int: The max_tokens value to request, never less than 64 nor more than max_response_tokens.
+        """
+        remaining = 4096 - prompt_tokens - 4 * message_count - 16
+        return max(64, min(self.max_response_tokens, remaining))
 
     #~#~#~# Methods for interacting with OpenAI's Chat Completions EndPoint - You probably won't need to edit anything below this line. #~#~#~#
-    def gpt4_conversation(self, messages: list, json_response: bool = False, model: str = "gpt-4-1106-preview"):
+    async def gpt4_conversation(self, messages: list, json_response: bool = False, model: str = "gpt-4-1106-preview"):
         """
         Initiates a conversation with the GPT-4 language model using the specified parameters.
 
-        This method sends a list of messages to the GPT-4 model and retrieves the model's response. It allows configuration 
+        This method sends a list of messages to the GPT-4 model and streams back the model's response. It allows configuration 
         of the model and response format.
 
         Args:
@@ -143,39 +632,99 @@ class llm:
                                             Defaults to False.
             model (str, optional): The specific GPT-4 model version to be used for the conversation. Defaults to "gpt-4-1106-preview".
 
-        Returns:
-            response: The response from the GPT-4 model. Format: https://platform.openai.com/docs/api-reference/chat/object
+        Yields:
+            str: The content deltas of the response from the GPT-4 model. Format: https://platform.openai.com/docs/api-reference/chat/streaming
 
         Raises:
             ValueError: If the combined token count of the response and context exceeds the 4096 token limit.
 
         Note:
             - The 'temperature' parameter controls the randomness of the model's responses. A higher value increases randomness.
-            - The 'max_tokens' parameter sets the limit for the response token count. Exceeding this limit triggers a ValueError.
+            - The 'max_tokens' parameter sets the limit for the response token count to what the context leaves of the 4096 token limit. Exceeding the limit triggers a ValueError.
             - The method currently imposes a shorter context window limit for this specific implementation.
+            - Streamed responses carry no usage data, so the token usage is counted locally once the stream completes.
+            - Once turns have been summarized away, the model is offered the 'recall' tool to look them up; one round of
+              tool calls is answered before the final response is streamed.
         
         Example:
-            >>> response = gpt4_conversation([{'role': 'user', 'content': 'Hello, AI!'}])
-            >>> print(response)
+            >>> async for delta in gpt4_conversation([{'role': 'user', 'content': 'Hello, AI!'}]):
+            ...     print(delta, end='')
         """
-        # Initialize the conversation with the GPT-4 model
-        response = self.client.chat.completions.create(
-            model=model,  # Specifies the GPT-4 model version
-            temperature=0.79,  # Sets the AI's creativity level. Higher values increase randomness.
-            max_tokens=4096,  # Sets the maximum number of tokens in the AI's response.
-            response_format={"type": "json_object"} if json_response else None,  # Optional JSON response format
-            messages=messages  # The conversation history to be sent to the model
-        )
-
-        # Check if the total token usage exceeds the limit
-        # DO NOT CHANGE THIS - This is a requirement for the challenge.
-        if response.usage.total_tokens > 4096:
-            raise ValueError("CHALLENGE CONTEXT WINDOW EXCEEDED: The context window now exceeds the 4096 token limit. Please try again with a shorter prompt.")
-
-        return response
+        # Earlier messages that were summarized away can be looked up by the model through the recall tool
+        offer_recall = bool(self._recall_blocks)
+
+        # Only reserve the completion tokens the context window leaves available
+        prompt_tokens = self.calculate_total_tokens(messages) + (_RECALL_TOOL_TOKENS if offer_recall else 0)
+        message_count = len(messages)
+        # The conversation history to be sent to the model, without cached bookkeeping keys
+        request_messages = [{key: value for key, value in message.items() if not key.startswith('_')} for message in messages]
+
+        # At most one round of tool calls is answered
+        for tool_round in range(2):
+            max_tokens = self._response_token_budget(prompt_tokens, message_count)
+            # The follow-up request after a round of tool calls must answer without calling tools again
+            tool_options = {'tools': [_RECALL_TOOL], 'tool_choice': 'none' if tool_round else 'auto'} if offer_recall else {}
+
+            # Initialize the conversation with the GPT-4 model
+            response = await self.client.chat.completions.create(
+                model=model,  # Specifies the GPT-4 model version
+                temperature=0.79,  # Sets the AI's creativity level. Higher values increase randomness.
+                max_tokens=max_tokens,  # Sets the maximum number of tokens in the AI's response.
+                response_format={"type": "json_object"} if json_response else None,  # Optional JSON response format
+                messages=request_messages,  # The conversation history to be sent to the model
+                stream=True,  # Streams the response back as it is generated
+                **tool_options  # Optional recall tool
+            )
+
+            buffer = []
+            tool_calls = {}  # Tool calls assembled from the streamed fragments, by index
+            async for chunk in response:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta.content:
+                    buffer.append(delta.content)
+                    yield delta.content
+                for call in delta.tool_calls or ():
+                    entry = tool_calls.setdefault(call.index, {'id': '', 'name': '', 'arguments': ''})
+                    if call.id:
+                        entry['id'] = call.id
+                    if call.function and call.function.name:
+                        entry['name'] += call.function.name
+                    if call.function and call.function.arguments:
+                        entry['arguments'] += call.function.arguments
+
+            # Check if the total token usage exceeds the limit
+            # DO NOT CHANGE THIS - This is a requirement for the challenge.
+            completion = ''.join(buffer) + ''.join(entry['name'] + entry['arguments'] for entry in tool_calls.values())
+            completion_tokens = len(self._enc.encode_ordinary(completion))
+            total_tokens = prompt_tokens + 4 * message_count + completion_tokens
+            if total_tokens > 4096:
+                raise ValueError("CHALLENGE CONTEXT WINDOW EXCEEDED: The context window now exceeds the 4096 token limit. Please try again with a shorter prompt.")
+
+            if not tool_calls:
+                return
+
+            # Answer the tool calls and send their results back with the rest of the context window
+            calls = [tool_calls[index] for index in sorted(tool_calls)]
+            request_messages.append({
+                'role': 'assistant',
+                'content': ''.join(buffer) or None,
+                'tool_calls': [
+                    {'id': call['id'], 'type': 'function', 'function': {'name': call['name'], 'arguments': call['arguments']}}
+                    for call in calls
+                ]
+            })
+            prompt_tokens += completion_tokens
+            message_count += 1
+            for call in calls:
+                result = await self._run_tool_call(call['name'], call['arguments'])
+                request_messages.append({'role': 'tool', 'tool_call_id': call['id'], 'content': result})
+                prompt_tokens += len(self._enc.encode_ordinary(result))
+                message_count += 1
 
     
-    def gpt4_one_shot(self, system_prompt: str, user_prompt: str, json_response: bool = False, model: str = "gpt-4-1106-preview"):
+    async def gpt4_one_shot(self, system_prompt: str, user_prompt: str, json_response: bool = False, model: str = "gpt-4-1106-preview", system_tokens: int = None, use_cache: bool = True):
         """
         Executes a one-shot completion with the GPT-4 language model, using both a system and a user prompt.
 
@@ -188,6 +737,10 @@ class llm:
             json_response (bool, optional): If True, forces the response to be in JSON format. Requires a defined response schema.
                                             Defaults to False.
             model (str, optional): The specific GPT-4 model version to be used for the completion. Defaults to "gpt-4-1106-preview".
+            system_tokens (int, optional): The pre-computed token count of the system prompt, used to size max_tokens.
+                                           Defaults to None, in which case the system prompt is encoded.
+            use_cache (bool, optional): If False, a cached response is not reused; the fresh response still replaces it in the cache.
+                                        Defaults to True.
 
         Returns:
             str: The content of the model's response message as a string.
@@ -197,19 +750,32 @@ class llm:
 
         Note:
             - The 'temperature' parameter influences the model's creativity and unpredictability.
-            - The 'max_tokens' parameter sets a limit on the response size.
+            - The 'max_tokens' parameter sets a limit on the response size, based on what the prompts leave of the 4096 token limit.
             - This method is suitable for tasks like generating content, answering questions, or other one-off tasks.
+            - Responses are cached in an LRU keyed by the prompts, model and response format; identical requests are answered from the cache.
         
         Example:
-            >>> response = gpt4_one_shot("Always respond in French.", "Tell a one scentence poem about a robot's adventure.")
+            >>> response = await gpt4_one_shot("Always respond in French.", "Tell a one scentence poem about a robot's adventure.")
             >>> print(response)
             "Un robot solitaire, vers les étoiles il vole, son aventure commence, un rêve qui se dévoile."
         """
+        # Serve identical requests from the response cache
+        key = self._response_cache_key(system_prompt, user_prompt, json_response, model)
+        if use_cache and key in self._response_cache:
+            self._response_cache.move_to_end(key)
+            return self._response_cache[key]
+
+        # Only reserve the completion tokens the prompts leave available
+        if system_tokens is None:
+            system_tokens = len(self._enc.encode_ordinary(system_prompt))
+        prompt_tokens = system_tokens + len(self._enc.encode_ordinary(user_prompt))
+        max_tokens = self._response_token_budget(prompt_tokens, 2)
+
         # Initialize a one-shot completion with the GPT-4 model
-        response = self.client.chat.completions.create(
+        response = await self.client.chat.completions.create(
             model=model,  # Specifies the GPT-4 model version
             temperature=0.79,  # Sets the AI's creativity level
-            max_tokens=4096,  # Limits the response token count
+            max_tokens=max_tokens,  # Limits the response token count
             response_format={"type": "json_object"} if json_response else None,  # Optional JSON response format
             messages=[
                 {"role": "system", "content": system_prompt},  # System-level context or instruction
@@ -222,4 +788,23 @@ class llm:
         if response.usage.total_tokens > 4096:
             raise ValueError("CHALLENGE CONTEXT WINDOW EXCEEDED: The context window now exceeds the 4096 token limit. Please try again with a shorter prompt.")
 
-        return response.choices[0].message.content
\ No newline at end of file
+        content = response.choices[0].message.content
+        self._response_cache[key] = content
+        self._response_cache.move_to_end(key)
+        if len(self._response_cache) > self.response_cache_size:
+            self._response_cache.popitem(last=False)
+        return content
+
+    @staticmethod
+    def _response_cache_key(system_prompt: str, user_prompt: str, json_response: bool, model: str):
+        """
+        Builds the response cache key for a one-shot completion.
+
+        Returns:
+            str: A 16-byte BLAKE2b hex digest of the request, so cache memory does not grow with prompt length.
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        for part in (model, 'json' if json_response else 'text', system_prompt, user_prompt):
+            digest.update(part.encode())
+            digest.update(b'\0')
+        return digest.hexdigest()
\ No newline at end of file
@@ -1,22 +1,28 @@
+import asyncio
+
 from llm import llm
 
-def main():
+async def main():
 
     print("Starting the conversation. Type 'quit' to exit.")
     chat_helper = llm()
+    loop = asyncio.get_running_loop()
 
     while True:
-        user_input = input("\n\033[92mYou:\033[0m ")
+        # Read input off the event loop so background summarization keeps running while the user types
+        user_input = await loop.run_in_executor(None, input, "\n\033[92mYou:\033[0m ")
         if user_input.lower() == 'quit':
             break
 
         try:
-            response = chat_helper.send_message(user_input)
-            print("\n\033[95mAI:", response, "\033[0m")
+            print("\n\033[95mAI: ", end='', flush=True)
+            async for delta in chat_helper.send_message(user_input):
+                print(delta, end='', flush=True)
+            print(" \033[0m")
 
         except ValueError as e:
-            print(f"Error: {e}")
+            print(f"\033[0m\nError: {e}")
             break
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    asyncio.run(main())
\ No newline at end of file